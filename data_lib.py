@@ -6,11 +6,15 @@ board
 - board_num (int) - KEY
 - mines (json - [(x, y)])
 
-board_position
+board_position_v2
 - board_num (int) - KEY
-- position_hash (uuid) - KEY
-- revealed_squares (json - [(x,y)])
-- flagged_squares (json - [(x,y)])
+- position_hash (int - Zobrist hash) - KEY
+- revealed_squares (blob - bitmask, bit coord_index(c))
+- flagged_squares (blob - bitmask, bit coord_index(c))
+
+board_position_v2 replaces board_position, which stored the squares as json and keyed rows
+by an older position hash.  Its rows can't be read in the new format and their hashes no
+longer match, so they aren't migrated; an existing board_position table is left as is.
 
 simulations
 - board_num (int) - KEY
@@ -20,48 +24,106 @@ simulations
 """
 
 import functools
-import json
 import os
+import random
 import sqlite3
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import attr
-from pypika import MySQLQuery, Table, Query
 
-from minesweeper_lib import *
+try:
+    import orjson
 
-DATA_DIR = "data"
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    _json_loads = orjson.loads
+except ImportError:
+    import json
 
+    _json_dumps = json.dumps
+    _json_loads = json.loads
 
-functools.lru_cache(1)
+from minesweeper_lib import *
 
+DATA_DIR = "data"
 
+# Bytes needed to hold one bit per grid cell.
+_MASK_BYTES = (SIZE_X * SIZE_Y + 7) // 8
+
+# Static SQL; bound parameters let sqlite reuse its cached prepared statements
+# instead of re-parsing fresh query text on every call.
+_READ_BOARD_SQL = "SELECT mines FROM board WHERE board_num = ?"
+_INSERT_BOARD_SQL = "INSERT INTO board(board_num, mines) VALUES (?, ?)"
+_READ_BOARD_POSITION_SQL = (
+    "SELECT revealed_squares, flagged_squares FROM board_position_v2"
+    " WHERE board_num = ? AND position_hash = ?"
+)
+_ALL_POSITIONS_SQL = "SELECT board_num, position_hash FROM board_position_v2"
+_READ_BOARD_POSITIONS_SQL = (
+    "SELECT position_hash, revealed_squares, flagged_squares FROM board_position_v2"
+    " WHERE board_num = ?"
+)
+_INSERT_BOARD_POSITION_SQL = (
+    "INSERT OR IGNORE INTO board_position_v2"
+    "(board_num, position_hash, revealed_squares, flagged_squares) VALUES (?, ?, ?, ?)"
+)
+
+
+@functools.lru_cache(maxsize=1)
 def connection() -> sqlite3.Connection:
-    return sqlite3.connect(os.path.join(DATA_DIR, "db.sql"), isolation_level=None)
+    conn = sqlite3.connect(os.path.join(DATA_DIR, "db.sql"), isolation_level=None)
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+    """)
+    return conn
 
 
-def coord_hash(coord: Coord) -> int:
-    def mini_hash(x):
-        return hash(x) % 2^16
-    return mini_hash(coord.x) * 2**16 + mini_hash(coord.y)
+# Zobrist keys per state, indexed by coord_index.  Seeded so hashes are stable across runs,
+# and kept to 63 bits so XORs of them still fit in a signed sqlite INT.
+_zobrist_rng = random.Random(0)
+_ZOBRIST_KEYS = {
+    State.CLICKED: [_zobrist_rng.getrandbits(63) for _ in range(SIZE_X * SIZE_Y)],
+    State.FLAGGED: [_zobrist_rng.getrandbits(63) for _ in range(SIZE_X * SIZE_Y)],
+}
 
 
 def position_hash(ms: Minesweeper) -> int:
     result = 0
-    for coord in grid_coords():
-        if ms.grid[coord].state == State.CLICKED:
-            result ^= coord_hash(coord) * 2**32
-        if ms.grid[coord].state == State.FLAGGED:
-            result ^= coord_hash(coord)
+    for i, cell in enumerate(ms.cells):
+        keys = _ZOBRIST_KEYS.get(cell.state)
+        if keys is not None:
+            result ^= keys[i]
     return result
 
 
 def coords_from_json(j: str) -> List[Coord]:
-    return [Coord(x=t[0], y=t[1]) for t in json.loads(j)]
+    return [Coord(x=t[0], y=t[1]) for t in _json_loads(j)]
 
 
 def json_from_coords(cs: List[Coord]) -> str:
-    return json.dumps([(t.x, t.y) for t in cs])
+    return _json_dumps([(t.x, t.y) for t in cs])
+
+
+def pack_coords(cs: List[Coord]) -> bytes:
+    mask = 0
+    for c in cs:
+        mask |= 1 << coord_index(c)
+    return mask.to_bytes(_MASK_BYTES, "little")
+
+
+def unpack_coords(b: bytes) -> List[Coord]:
+    result = []
+    mask = int.from_bytes(b, "little")
+    while mask:
+        low_bit = mask & -mask
+        y, x = divmod(low_bit.bit_length() - 1, SIZE_X)
+        result.append(Coord(x=x, y=y))
+        mask ^= low_bit
+    return result
 
 
 def make_tables() -> None:
@@ -73,11 +135,11 @@ def make_tables() -> None:
         );
     """)
     cur.execute("""
-        CREATE TABLE IF NOT EXISTS board_position (
+        CREATE TABLE IF NOT EXISTS board_position_v2 (
             board_num INT,
             position_hash INT,
-            revealed_squares VARCHAR NOT NULL,
-            flagged_squares VARCHAR NOT NULL,
+            revealed_squares BLOB NOT NULL,
+            flagged_squares BLOB NOT NULL,
             PRIMARY KEY (board_num, position_hash)
         )
     """)
@@ -90,14 +152,7 @@ class BoardValue(object):
 
 def read_board(board_num: int) -> Optional[BoardValue]:
     """Will return None if board_num is not found"""
-    board = Table("board")
-    query = (
-        Query.from_(board)
-        .select(board.mines)
-        .where(board.board_num == board_num)
-        .get_sql()
-    )
-    res = connection().cursor().execute(query)
+    res = connection().execute(_READ_BOARD_SQL, (board_num,))
     if one := res.fetchone():
         return BoardValue(
             mines=coords_from_json(one[0]),
@@ -105,14 +160,7 @@ def read_board(board_num: int) -> Optional[BoardValue]:
 
 
 def write_board(board_num: int, value: BoardValue) -> None:
-    board = Table("board")
-    query = (
-        Query.into(board)
-        .columns(board.board_num, board.mines)
-        .insert(board_num, json_from_coords(value.mines))
-        .get_sql()
-    )
-    _ = connection().cursor().execute(query)
+    _ = connection().execute(_INSERT_BOARD_SQL, (board_num, json_from_coords(value.mines)))
 
 
 @attr.s()
@@ -122,48 +170,64 @@ class BoardPositionValue(object):
 
 
 def board_position_from_ms(ms: Minesweeper) -> BoardPositionValue:
+    revealed_squares, flagged_squares = [], []
+    for cell in ms.cells:
+        if cell.state is State.CLICKED:
+            revealed_squares.append(cell.coord)
+        elif cell.state is State.FLAGGED:
+            flagged_squares.append(cell.coord)
     return BoardPositionValue(
-        revealed_squares = [c for c in grid_coords() if ms.grid[c].state == State.CLICKED],
-        flagged_squares = [c for c in grid_coords() if ms.grid[c].state == State.FLAGGED],
+        revealed_squares=revealed_squares,
+        flagged_squares=flagged_squares,
     )
 
 
 def read_board_position(board_num: int, position_hash: int) -> BoardPositionValue:
-    board_position = Table("board_position")
-    query = (
-        Query.from_(board_position)
-        .select(board_position.revealed_squares, board_position.flagged_squares)
-        .where(board_position.board_num == board_num)
-        .where(board_position.position_hash == position_hash)
-        .get_sql()
-    )
-    res = connection().cursor().execute(query)
+    res = connection().execute(_READ_BOARD_POSITION_SQL, (board_num, position_hash))
     vals = res.fetchone()
     return BoardPositionValue(
-        revealed_squares=coords_from_json(vals[0]),
-        flagged_squares=coords_from_json(vals[1]),
+        revealed_squares=unpack_coords(vals[0]),
+        flagged_squares=unpack_coords(vals[1]),
     )
 
 
 def all_positions() -> List[Tuple[int, int]]:
-    board_position = Table("board_position")
-    query = (
-        Query.from_(board_position)
-        .select(board_position.board_num, board_position.position_hash)
-        .get_sql()
-    )
-    res = connection().cursor().execute(query)
+    res = connection().execute(_ALL_POSITIONS_SQL)
     return res.fetchall()
 
 
+def read_board_positions(board_num: int) -> Dict[int, BoardPositionValue]:
+    """All positions stored for board_num, keyed by position_hash, in a single query."""
+    res = connection().execute(_READ_BOARD_POSITIONS_SQL, (board_num,))
+    return {
+        position_hash: BoardPositionValue(
+            revealed_squares=unpack_coords(revealed_squares),
+            flagged_squares=unpack_coords(flagged_squares),
+        )
+        for position_hash, revealed_squares, flagged_squares in res
+    }
+
+
 def write_board_position(board_num: int, position_hash: int, value: BoardPositionValue) -> None:
-    board_position = Table("board_position")
-    query = (
-        MySQLQuery.into(board_position)
-        .columns(board_position.board_num, board_position.position_hash, board_position.revealed_squares, board_position.flagged_squares)
-        .insert(board_num, position_hash, json_from_coords(value.revealed_squares), json_from_coords(value.flagged_squares))
-        .ignore()
-        .get_sql()
+    _ = connection().execute(
+        _INSERT_BOARD_POSITION_SQL,
+        (board_num, position_hash, pack_coords(value.revealed_squares), pack_coords(value.flagged_squares)),
     )
-    query = query.replace("INSERT IGNORE", "INSERT OR IGNORE")
-    _ = connection().cursor().execute(query)
+
+
+def write_board_positions(rows: Iterable[Tuple[int, int, BoardPositionValue]]) -> None:
+    """Writes many (board_num, position_hash, value) rows in a single transaction."""
+    conn = connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            _INSERT_BOARD_POSITION_SQL,
+            (
+                (board_num, position_hash, pack_coords(value.revealed_squares), pack_coords(value.flagged_squares))
+                for board_num, position_hash, value in rows
+            ),
+        )
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
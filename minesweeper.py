@@ -1,11 +1,12 @@
 import argparse
+import bisect
 import collections
 import functools
 import itertools
 import math
 import random
 import tkinter as tk
-from typing import Callable, List, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 from minesweeper_lib import *
 import data_lib
@@ -13,29 +14,60 @@ import data_lib
 
 window = None
 
+# Board positions are buffered and written in batches, rather than one row per click.
+POSITION_FLUSH_SIZE = 10
+pending_positions = collections.deque()
+
+
+def flush_positions() -> None:
+    if not pending_positions:
+        return
+    data_lib.write_board_positions(pending_positions)
+    pending_positions.clear()
+
 
 def click(_, action_type: ActionType, coord: Coord, ms: Minesweeper, display_updater: Callable, board_num: int) -> None:
     solve(Action(type=action_type, coord=coord), ms)
-    data_lib.write_board_position(
-        board_num=board_num,
-        position_hash=data_lib.position_hash(ms),
-        value=data_lib.board_position_from_ms(ms),
-    )
+    pending_positions.append((
+        board_num,
+        data_lib.position_hash(ms),
+        data_lib.board_position_from_ms(ms),
+    ))
+    if len(pending_positions) >= POSITION_FLUSH_SIZE:
+        flush_positions()
     display_updater()
 
 
-def get_variables_constraint(coord: Coord, ms: Minesweeper) -> Tuple[List[Coord], int]:
-    variables = list(get_neighbors(coord).filter(
-        lambda n: ms.grid[n].state == State.HIDDEN))
+def close() -> None:
+    try:
+        flush_positions()
+    finally:
+        # A failed write mustn't leave the window impossible to close
+        window.destroy()
+
+
+VariablesConstraint = Tuple[List[Coord], int]
+
+
+def get_variables_constraint(coord: Coord, ms: Minesweeper, cache: Optional[Dict[Coord, VariablesConstraint]] = None) -> VariablesConstraint:
+    """If a cache is passed, the caller must drop a coord's entry whenever one of its neighbors changes."""
+    if cache is not None:
+        if coord not in cache:
+            cache[coord] = get_variables_constraint(coord, ms)
+        return cache[coord]
+
+    neighbors = get_neighbors(coord)
+    hidden = ms.hidden
+    variables = [n for n in neighbors if n in hidden]
     showing_num = ms.grid[coord].n_adj_mines
-    flagged_mines = len(list(get_neighbors(coord).filter(
-        lambda n: ms.grid[n].state == State.FLAGGED)))
+    flagged = ms.flagged
+    flagged_mines = len([n for n in neighbors if n in flagged])
     constraint = showing_num - flagged_mines
     return variables, constraint
 
 
-def solve_constraint(coord: Coord, ms: Minesweeper) -> List[Action]:
-    variables, constraint = get_variables_constraint(coord, ms)
+def solve_constraint(coord: Coord, ms: Minesweeper, vc_cache: Optional[Dict[Coord, VariablesConstraint]] = None) -> List[Action]:
+    variables, constraint = get_variables_constraint(coord, ms, vc_cache)
 
     if constraint == 0:
         return [Action(type=ActionType.CLEAR, coord=c) for c in variables]
@@ -46,66 +78,110 @@ def solve_constraint(coord: Coord, ms: Minesweeper) -> List[Action]:
     return []
 
 
-def powerset(iterable):
-    """Recipe from itertools
+def split_components(vcs: List[VariablesConstraint]) -> List[Tuple[Set[Coord], List[VariablesConstraint]]]:
+    """Groups constraints into components that share no variables.
 
-    powerset([1,2,3]) --> () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)
+    Each component can be enumerated on its own, which is exponentially cheaper than
+    enumerating the union of all their variables at once.
     """
-    s = list(iterable)
-    return itertools.chain.from_iterable(itertools.combinations(s, r) for r in range(len(s)+1))
-
-
-def solve_variable(coord: Coord, ms: Minesweeper) -> List[Action]:
-    constraint_neighbors = list(get_neighbors(coord).filter(
-        lambda c: ms.grid[c].state == State.CLICKED))
-
-    vcs = [get_variables_constraint(x, ms) for x in constraint_neighbors]
-    v_set = set()
-    for v, _ in vcs:
-        v_set |= set(v)
-
-    # We can make this part more efficient later if we need to
-    valid = []
-    for s in powerset(v_set):
-        # s represents all the 1s, or mines
-        for v, c in vcs:
-            if len([t for t in v if t in s]) != c:
-                break
-        else:
-            valid.append(s)
+    components = []
+    for v, c in vcs:
+        merged_vars, merged_vcs = set(v), [(v, c)]
+        rest = []
+        for comp_vars, comp_vcs in components:
+            if comp_vars & merged_vars:
+                merged_vars |= comp_vars
+                merged_vcs += comp_vcs
+            else:
+                rest.append((comp_vars, comp_vcs))
+        rest.append((merged_vars, merged_vcs))
+        components = rest
+    return components
+
+
+def satisfying_subsets(constraints: List[Tuple[int, int]]) -> Iterator[int]:
+    """Yields every subset mask, over the union of the constraint masks, that satisfies them all.
+
+    Constraints are (mask, count) pairs: exactly count bits of mask must be set.  Rather than
+    testing all 2**n subsets, each constraint in turn chooses its remaining mines from the
+    variables that earlier constraints haven't already decided.
+    """
+    def extend(i: int, decided: int, mines: int) -> Iterator[int]:
+        if i == len(constraints):
+            yield mines
+            return
+        mask, count = constraints[i]
+        remaining = count - (mines & mask).bit_count()
+        free = []
+        undecided = mask & ~decided
+        while undecided:
+            bit = undecided & -undecided
+            free.append(bit)
+            undecided ^= bit
+        if not 0 <= remaining <= len(free):
+            return
+        for chosen in itertools.combinations(free, remaining):
+            yield from extend(i + 1, decided | mask, mines | sum(chosen))
+
+    return extend(0, 0, 0)
+
+
+def solve_variable(coord: Coord, ms: Minesweeper, vc_cache: Optional[Dict[Coord, VariablesConstraint]] = None) -> List[Action]:
+    clicked = ms.clicked
+    constraint_neighbors = [c for c in get_neighbors(coord) if c in clicked]
+
+    vcs = [get_variables_constraint(x, ms, vc_cache) for x in constraint_neighbors]
 
     result = []
-    for t in v_set:
-        if all([t in s for s in valid]):
-            result.append(Action(type=ActionType.FLAG, coord=t))
-        if not any([t in s for s in valid]):
-            result.append(Action(type=ActionType.CLEAR, coord=t))
+    for v_set, component in split_components(vcs):
+        bits = {t: 1 << i for i, t in enumerate(v_set)}
+        constraints = [(sum(bits[t] for t in v), c) for v, c in component]
+        # Each subset mask represents all the 1s, or mines
+        all_mask, any_mask = -1, 0
+        for s in satisfying_subsets(constraints):
+            all_mask &= s
+            any_mask |= s
+
+        for t, bit in bits.items():
+            if all_mask & bit:
+                result.append(Action(type=ActionType.FLAG, coord=t))
+            if not any_mask & bit:
+                result.append(Action(type=ActionType.CLEAR, coord=t))
 
     return result
 
 
 def do(action: Action, ms: Minesweeper) -> bool:
     """Returns true iff the game ends."""
-    cell = ms.grid[action.coord]
+    coord = action.coord
+    cell = ms.grid[coord]
     if cell.state in (State.CLICKED, State.FLAGGED):
         return False
 
-    if action.type == ActionType.CLEAR:
+    # The dirty/hidden/clicked/flagged sets only change where cell.state does, so an unknown
+    # action type leaves them in step with the board.
+    if action.type is ActionType.CLEAR:
+        ms.dirty.add(coord)
+        ms.hidden.discard(coord)
         if cell.is_mine:
             cell.state = State.MISCLICKED
             ms.lost = True
             return True
 
         cell.state = State.CLICKED
+        ms.clicked.add(coord)
         ms.clicked_count += 1
 
-    elif action.type == ActionType.FLAG:
+    elif action.type is ActionType.FLAG:
+        ms.dirty.add(coord)
+        ms.hidden.discard(coord)
         if not cell.is_mine:
             cell.state = State.MISCLICKED
             ms.lost = True
             return True
 
         cell.state = State.FLAGGED
+        ms.flagged.add(coord)
         ms.n_flags += 1
 
     else:
@@ -114,47 +190,112 @@ def do(action: Action, ms: Minesweeper) -> bool:
     return False
 
 
-def my_append(queue, element):
-    """Won't append if duplicate"""
-    if element in queue:
-        return
-    queue.append(element)
+class OrderedQueue(object):
+    """FIFO queue that won't append an element that is already queued."""
+    __slots__ = ("_queue", "_members")
 
+    def __init__(self):
+        self._queue = collections.deque()
+        self._members = set()
 
-def calc_prob(ms: Minesweeper) -> None:
-    all_hidden = list(grid_coords().filter(
-        lambda c: ms.grid[c].state == State.HIDDEN))
-    all_constraints = [get_variables_constraint(c, ms) for c in grid_coords().filter(
-        lambda c: ms.grid[c].state == State.CLICKED)]
-    all_constraints = [(set(v), c) for v, c in all_constraints if len(v) > 0]
-    all_constraints.sort(key=lambda x: -len(x[0]))
-    all_variables = set()
-    for x in all_constraints:
-        for xi in x[0]:
-            all_variables.add(xi)
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def push(self, element) -> None:
+        if element in self._members:
+            return
+        self._members.add(element)
+        self._queue.append(element)
+
+    def popleft(self):
+        element = self._queue.popleft()
+        self._members.discard(element)
+        return element
 
-    out = ms.n_mines - ms.n_flags
-    tot = len(all_hidden)
-    sz = len(all_variables)
-    prob_mines = list()
-    for i in range(sz+1):
-        prob_mines.append(math.comb(sz, i) * math.comb(tot -
-                          sz, out-i) / math.comb(tot, out))
 
-    nums = {c: 0 for c in all_variables}
+def sample_mines(constraints: List[Tuple[int, int]], sz: int, cdf: List[float], n_sims: int) -> Tuple[List[int], int]:
+    """Rejection-samples mine placements over sz variables until n_sims satisfy every constraint.
+
+    Constraints are (mask, count) pairs as in satisfying_subsets, and cdf is the cumulative weight of
+    placing 0..sz mines.  Returns, per variable, how many accepted samples put a mine on it, and
+    the number of accepted samples.
+    """
+    # Sample mine counts by inverse CDF, rather than having random.choices re-accumulate the
+    # weights on every trial.
+    cdf_total = cdf[-1]
+    variable_bits = [1 << i for i in range(sz)]
+    nums = [0] * sz
     den = 0
-    while den < N_SIMS:
-        n = random.choices(list(range(sz+1)), weights=prob_mines)[0]
-        mines = set(random.sample(all_variables, n))
-        for v, c in all_constraints:
-            if len(mines & v) != c:
+    # Bound once, since the loop may run many times when the constraints are tight.  These are
+    # still the module-level generator's methods, so random.seed() applies.
+    rand, sample, bisect_right = random.random, random.sample, bisect.bisect
+    while den < n_sims:
+        n = bisect_right(cdf, rand() * cdf_total)
+        # Distinct bits, so summing them builds the whole sample mask in one call
+        mines = sum(sample(variable_bits, n))
+        for mask, count in constraints:
+            if (mines & mask).bit_count() != count:
                 break
         else:
             den += 1
-            for c in mines:
-                nums[c] += 1
-    for c, p in nums.items:
+            while mines:
+                low_bit = mines & -mines
+                nums[low_bit.bit_length() - 1] += 1
+                mines ^= low_bit
+    return nums, den
+
+
+def mine_count_probs(sz: int, tot: int, out: int) -> List[float]:
+    """Probability that exactly 0..sz of the out remaining mines, spread over tot hidden cells, land
+    among sz given cells.
+
+    This is the hypergeometric pmf.  Rather than three math.comb calls per count, the two
+    numerator combinations are stepped from one count to the next with exact integer updates.
+    """
+    other = tot - sz
+    # Counts outside [lo, hi] are impossible: the cells outside can't hold the rest, or there
+    # aren't enough mines left.
+    lo, hi = max(0, out - other), min(sz, out)
+    prob_mines = [0.0] * (sz + 1)
+    if lo > hi:
+        return prob_mines
+    den = math.comb(tot, out)
+    ways_in, ways_out = math.comb(sz, lo), math.comb(other, out - lo)
+    for i in range(lo, hi + 1):
+        prob_mines[i] = ways_in * ways_out / den
+        # C(sz, i+1) and C(other, out-i-1), from C(sz, i) and C(other, out-i)
+        ways_in = ways_in * (sz - i) // (i + 1)
+        ways_out = ways_out * (out - i) // (other - out + i + 1)
+    return prob_mines
+
+
+def calc_prob(ms: Minesweeper) -> None:
+    # Sorted so variables are numbered in board order, as a grid scan would
+    all_constraints = [get_variables_constraint(c, ms) for c in sorted(ms.clicked)]
+    all_constraints = [(v, c) for v, c in all_constraints if len(v) > 0]
+    all_constraints.sort(key=lambda x: -len(x[0]))
+    all_variables = list()
+    var_bits = dict()
+    for v, _ in all_constraints:
+        for xi in v:
+            if xi not in var_bits:
+                var_bits[xi] = 1 << len(all_variables)
+                all_variables.append(xi)
+
+    # Each constraint becomes a bitmask over all_variables, so checking a sample is an AND and
+    # a popcount per constraint rather than a set intersection.
+    constraint_masks = [(sum(var_bits[xi] for xi in v), c) for v, c in all_constraints]
+
+    out = ms.n_mines - ms.n_flags
+    tot = len(ms.hidden)
+    sz = len(all_variables)
+    prob_mines = mine_count_probs(sz, tot, out)
+    cdf = list(itertools.accumulate(prob_mines))
+
+    nums, den = sample_mines(constraint_masks, sz, cdf, N_SIMS)
+    for c, p in zip(all_variables, nums):
         ms.probs[c] = round(100 * p / den)
+        ms.dirty.add(c)
 
 
 def solve(starting_action: Action, ms: Minesweeper) -> Minesweeper:
@@ -163,8 +304,13 @@ def solve(starting_action: Action, ms: Minesweeper) -> Minesweeper:
         return
 
     actions = [starting_action]
-    constraint_solvers = collections.deque()
-    variable_solvers = collections.deque()
+    constraint_solvers = OrderedQueue()
+    variable_solvers = OrderedQueue()
+    # Constraints are reused across solver steps until a neighboring cell changes.
+    vc_cache = dict()
+    hidden, clicked = ms.hidden, ms.clicked
+    # Cells already queued by a flood, so neighboring 0s don't queue them again
+    flooded = set()
 
     while actions or constraint_solvers or variable_solvers:
         game_over = False
@@ -172,28 +318,40 @@ def solve(starting_action: Action, ms: Minesweeper) -> Minesweeper:
             action = actions.pop()
             coord = action.coord
             game_over |= do(action, ms)
-            if action.type == ActionType.CLEAR:
-                my_append(constraint_solvers, coord)
-                for c in get_neighbors(coord).filter(lambda n: ms.grid[n].state == State.CLICKED):
-                    my_append(constraint_solvers, c)
-                for c in get_neighbors(coord).filter(lambda n: ms.grid[n].state == State.HIDDEN):
-                    my_append(variable_solvers, c)
-            if action.type == ActionType.FLAG:
-                for c in get_neighbors(coord).filter(lambda n: ms.grid[n].state == State.CLICKED):
-                    my_append(constraint_solvers, c)
-
-        # ms.tk.update()
-        # time.sleep(2)
+            neighbors = get_neighbors(coord)
+            for c in neighbors:
+                vc_cache.pop(c, None)
+            if action.type is ActionType.CLEAR:
+                # A cleared 0 has nothing to deduce, so flood its hidden neighbors right away
+                # rather than routing it and them through the solver queues.
+                flood = coord in clicked and ms.grid[coord].n_adj_mines == 0
+                if flood:
+                    to_flood = [c for c in neighbors if c in hidden and c not in flooded]
+                    flooded.update(to_flood)
+                    actions += [Action(type=ActionType.CLEAR, coord=c) for c in to_flood]
+                else:
+                    constraint_solvers.push(coord)
+                for c in neighbors:
+                    if c in clicked:
+                        constraint_solvers.push(c)
+                if not flood:
+                    for c in neighbors:
+                        if c in hidden:
+                            variable_solvers.push(c)
+            if action.type is ActionType.FLAG:
+                for c in neighbors:
+                    if c in clicked:
+                        constraint_solvers.push(c)
 
         if game_over:
             break
 
         if constraint_solvers:
             coord = constraint_solvers.popleft()
-            actions += solve_constraint(coord, ms)
+            actions += solve_constraint(coord, ms, vc_cache)
         elif variable_solvers:
             coord = variable_solvers.popleft()
-            actions += solve_variable(coord, ms)
+            actions += solve_variable(coord, ms, vc_cache)
 
     if ms.clicked_count == (SIZE_X * SIZE_Y) - N_MINES:
         # This is the win condition, but currently we don't do anything.  Sorry.
@@ -215,7 +373,7 @@ if __name__ == "__main__":
     bv = data_lib.read_board(board_num)
     if not bv:
         bv = data_lib.BoardValue(
-            mines=list(random.sample(list(grid_coords()), N_MINES)),
+            mines=random.sample(grid_coords(), N_MINES),
         )
         data_lib.write_board(board_num, bv)
 
@@ -223,6 +381,7 @@ if __name__ == "__main__":
     window = tk.Tk()
     # set program title
     window.title("Minesweeper")
+    window.protocol("WM_DELETE_WINDOW", close)
 
     ms = Minesweeper(bv.mines)
     _ = Display(
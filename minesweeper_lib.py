@@ -4,7 +4,7 @@ import itertools
 import platform
 import random
 import tkinter as tk
-from typing import Callable, Dict, List, Optional
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
 
 import attr
 
@@ -13,6 +13,8 @@ SIZE_X = 30
 SIZE_Y = 16
 N_MINES = 99
 
+TILE_SIZE = 16  # pixels, matching images/tile_*.gif
+
 BTN_CLICK = "<Button-1>"
 BTN_FLAG = "<Button-2>" if platform.system() == 'Darwin' else "<Button-3>"
 
@@ -26,10 +28,9 @@ class State(enum.Enum):
     MISCLICKED = 3
 
 
-@attr.s(frozen=True)
-class Coord(object):
-    x: int = attr.ib()
-    y: int = attr.ib()
+class Coord(NamedTuple):
+    x: int
+    y: int
 
 
 class ActionType(enum.Enum):
@@ -38,60 +39,53 @@ class ActionType(enum.Enum):
     FLAG = 2
 
 
-@attr.s(frozen=True)
+@attr.s(frozen=True, slots=True)
 class Action(object):
     type: ActionType = attr.ib()
     coord: Coord = attr.ib()
 
 
-@attr.s()
+@attr.s(slots=True)
 class Cell(object):
     coord: Coord = attr.ib()
     is_mine: bool = attr.ib(default=False)
     state: State = attr.ib(default=State.HIDDEN)
     n_adj_mines: int = attr.ib(default=0)
 
-    def __eq__(self, other: 'Cell') -> bool:
-        if self.is_mine != other.is_mine:
-            return False
-        if self.state != other.state:
-            return False
-        if self.n_adj_mines != other.n_adj_mines:
-            return False
-        return True
-
-    def copy(self) -> 'Cell':
-        return Cell(
-            coord=self.coord,
-            is_mine=self.is_mine,
-            state=self.state,
-            n_adj_mines=self.n_adj_mines,
-        )
-
-
-@attr.s()
+
+@attr.s(slots=True)
 class BoardState(object):
-    grid: Dict[Coord, Optional[Cell]] = attr.ib(
-        factory=lambda: {c: None for c in grid_coords()})
-    probs: Dict[Coord, int] = attr.ib(factory=lambda: {c: None for c in grid_coords()})
     n_mines: Optional[int] = attr.ib(default=None)
     n_flags: Optional[int] = attr.ib(default=None)
     lost: bool = attr.ib(default=False)
 
 
+# Image names for the cell states that don't depend on anything else
+_STATE_IMAGES = {
+    State.HIDDEN: "plain",
+    State.FLAGGED: "flag",
+    State.MISCLICKED: "wrong",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _image(file: str) -> tk.PhotoImage:
+    """Each tile GIF is decoded once per process; needs a Tk root to exist already."""
+    return tk.PhotoImage(file=file)
+
+
 class _Display(object):
     def __init__(self, tk_obj, ms, click_callback, right_click_callback):
         # import images
         self.images = {
-            "plain": tk.PhotoImage(file="images/tile_plain.gif"),
-            "mine": tk.PhotoImage(file="images/tile_mine.gif"),
-            "flag": tk.PhotoImage(file="images/tile_flag.gif"),
-            "wrong": tk.PhotoImage(file="images/tile_wrong.gif"),
-            "numbers": [tk.PhotoImage(file="images/tile_clicked.gif")],
+            "plain": _image("images/tile_plain.gif"),
+            "mine": _image("images/tile_mine.gif"),
+            "flag": _image("images/tile_flag.gif"),
+            "wrong": _image("images/tile_wrong.gif"),
+            "numbers": [_image("images/tile_clicked.gif")],
         }
         for i in range(1, 9):
-            self.images["numbers"].append(
-                tk.PhotoImage(file=f"images/tile_{i}.gif"))
+            self.images["numbers"].append(_image(f"images/tile_{i}.gif"))
 
         # set up frame
         self.tk = tk_obj
@@ -99,79 +93,100 @@ class _Display(object):
         self.frame = tk.Frame(self.tk)
         self.frame.pack()
 
+        # set up the board: one canvas with an image and a text item per cell, rather than a
+        # widget per cell, so redraws are cheap item updates and there are only two bindings
+        self.canvas = tk.Canvas(self.frame, width=SIZE_X*TILE_SIZE, height=SIZE_Y*TILE_SIZE,
+                                highlightthickness=0)
+        self.canvas.grid(row=0, column=0, columnspan=3)
+        self.canvas.bind(BTN_CLICK, functools.partial(self.on_event, callback=click_callback))
+        self.canvas.bind(BTN_FLAG, functools.partial(self.on_event, callback=right_click_callback))
+
+        self.cell_images: Dict[Coord, int] = dict()
+        self.cell_text_items: Dict[Coord, int] = dict()
+        # What each cell's items currently show, so unchanged options aren't resent
+        self.drawn_images: Dict[Coord, tk.PhotoImage] = dict()
+        self.drawn_texts: Dict[Coord, str] = dict()
+        for coord in grid_coords():
+            self.drawn_images[coord] = self.images["plain"]
+            self.drawn_texts[coord] = ""
+            left, top = coord.x * TILE_SIZE, coord.y * TILE_SIZE
+            self.cell_images[coord] = self.canvas.create_image(
+                left, top, anchor="nw", image=self.images["plain"])
+            self.cell_text_items[coord] = self.canvas.create_text(
+                left + TILE_SIZE // 2, top + TILE_SIZE // 2, text="", font=("Helvetica", 8))
+
         # set up labels/UI
         self.mines = tk.Label(self.frame)
         self.flags = tk.Label(self.frame)
-        self.mines.grid(row=SIZE_Y+1, column=0,
-                        columnspan=int(SIZE_X/2))  # bottom left
-        self.flags.grid(row=SIZE_Y+1, column=int(SIZE_X/2)-1,
-                        columnspan=int(SIZE_X/2))  # bottom right
-
-        self.cell_buttons: Dict[Coord, tk.Button] = dict()
-        self.cell_texts: Dict[Coord, str] = dict()
-        for coord in grid_coords():
-            self.cell_texts[coord] = ""
-            cell_button = tk.Button(
-                self.frame, text="", compound="center", font=("Helvetica", 8))
-            cell_button.bind(BTN_CLICK, functools.partial(click_callback, coord=coord, ms=self.ms, display_updater=self.update))
-            cell_button.bind(BTN_FLAG, functools.partial(right_click_callback, coord=coord, ms=self.ms, display_updater=self.update))
-            cell_button.grid(row=coord.y, column=coord.x)
-            self.cell_buttons[coord] = cell_button
+        self.mines.grid(row=1, column=0, sticky="w")  # bottom left
+        self.flags.grid(row=1, column=2, sticky="e")  # bottom right
 
         self.restart_button = tk.Button(self.frame)
-        self.restart_button.grid(row=SIZE_Y+1, column=SIZE_X//2)
+        self.restart_button.grid(row=1, column=1)
         self.restart_button.config(image=self.images["mine"])
 
         # Minesweeper has to update this for the first time, will need to check None-ness
         self.state = BoardState()
+        self.update_pending = False
 
         self.update()
 
+    def on_event(self, event, callback) -> None:
+        coord = Coord(event.x // TILE_SIZE, event.y // TILE_SIZE)
+        if coord not in self.cell_images:
+            # Clicked the canvas outside the board
+            return
+        callback(event, coord=coord, ms=self.ms, display_updater=self.schedule_update)
+
+    def schedule_update(self) -> None:
+        """Queues one redraw for the next idle cycle, however many times it's called before then."""
+        if self.update_pending:
+            return
+        self.update_pending = True
+        self.tk.after_idle(self.flush_update)
+
+    def flush_update(self) -> None:
+        self.update_pending = False
+        self.update()
+
+    def draw_cell(self, coord: Coord, image: tk.PhotoImage, text: str) -> None:
+        """Only sends Tk the options that differ from what's already drawn."""
+        if self.drawn_images[coord] is not image:
+            self.drawn_images[coord] = image
+            self.canvas.itemconfigure(self.cell_images[coord], image=image)
+        if self.drawn_texts[coord] != text:
+            self.drawn_texts[coord] = text
+            self.canvas.itemconfigure(self.cell_text_items[coord], text=text)
+
     def update(self) -> None:
-        for coord, prob in self.ms.probs.items():
-            if prob is None:
-                continue
-            self.cell_texts[coord] = str(prob)
-
-        for coord, cell in self.ms.grid.items():
-            if self.state.grid[coord] == cell and self.state.lost == self.ms.lost and self.state.probs[coord] == self.ms.probs[coord]:
-                # Nothing to update.  Whole board gets updated when lost changes; minimal inefficiency
-                continue
-
-            self.state.grid[coord] = cell.copy()
-
-            if cell.state == State.MISCLICKED:
-                self.cell_texts[coord] = ""
-                self.cell_buttons[coord].config(image=self.images["wrong"],
-                                                text=self.cell_texts[coord],
-                                                )
-                continue
-
-            if self.ms.lost and cell.is_mine:
-                self.cell_texts[coord] = ""
-                self.cell_buttons[coord].config(
-                    image=self.images["mine"],
-                    text=self.cell_texts[coord],
-                )
-                continue
-
-            if cell.state == State.HIDDEN:
-                self.cell_buttons[coord].config(
-                    image=self.images["plain"],
-                    text=self.cell_texts[coord],
-                )
-            if cell.state == State.CLICKED:
-                self.cell_texts[coord] = ""
-                self.cell_buttons[coord].config(
-                    image=self.images["numbers"][cell.n_adj_mines],
-                    text=self.cell_texts[coord],
-                )
-            if cell.state == State.FLAGGED:
-                self.cell_texts[coord] = ""
-                self.cell_buttons[coord].config(
-                    image=self.images["flag"],
-                    text=self.cell_texts[coord],
-                )
+        dirty = self.ms.dirty
+        if self.state.lost != self.ms.lost:
+            # Only mines are drawn differently once lost; the misclicked cell is already dirty
+            dirty.update(self.ms.mine_coords)
+
+        # Looked up once here rather than per dirty cell
+        grid, probs, lost = self.ms.grid, self.ms.probs, self.ms.lost
+        images = self.images
+        plain, wrong, mine, numbers = images["plain"], images["wrong"], images["mine"], images["numbers"]
+        for coord in dirty:
+            cell = grid[coord]
+            state = cell.state
+
+            if state is State.MISCLICKED:
+                image = wrong
+            elif lost and cell.is_mine:
+                image = mine
+            elif state is State.CLICKED:
+                image = numbers[cell.n_adj_mines]
+            else:
+                image = images[_STATE_IMAGES[state]]
+
+            # Probabilities are only shown on hidden cells.  calc_prob marks the cells it
+            # estimates dirty, so reading them here keeps texts in step with images.
+            prob = probs.get(coord) if image is plain else None
+            self.draw_cell(coord, image, "" if prob is None else str(prob))
+
+        dirty.clear()
 
         if self.state.n_mines != self.ms.n_mines:
             self.state.n_mines = self.ms.n_mines
@@ -194,39 +209,40 @@ def Display(*args, **kwargs) -> _Display:
     return _Display(*args, **kwargs)
 
 
-class Neighbors(object):
-    def __init__(self, coords: List[Coord]):
-        self.coords = coords
-        self.filters = [lambda n: 0 <= n.x < SIZE_X and 0 <= n.y < SIZE_Y]
+_GRID_COORDS = tuple(Coord(x, y) for x, y in itertools.product(range(SIZE_X), range(SIZE_Y)))
 
-    def filter(self, f: Callable) -> "Neighbors":
-        self.filters.append(f)
-        return self
 
-    def __iter__(self):
-        for c in self.coords:
-            for filter in self.filters:
-                if not filter(c):
-                    break
-            else:
-                yield c
+# The _GRID_COORDS instance for each (x, y), so tables can share it rather than build their own
+_SHARED_COORDS: Dict[Tuple[int, int], Coord] = {(c.x, c.y): c for c in _GRID_COORDS}
+
+
+def grid_coords() -> Tuple[Coord, ...]:
+    return _GRID_COORDS
+
 
+def coord_index(coord: Coord) -> int:
+    """Position of coord in the flat, row-major Minesweeper.cells list."""
+    return coord.y * SIZE_X + coord.x
 
-def grid_coords() -> Neighbors:
-    result = []
-    for x, y in itertools.product(range(SIZE_X), range(SIZE_Y)):
-        result.append(Coord(x, y))
-    return Neighbors(result)
 
+NEIGHBOR_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
 
-def get_neighbors(coord: Coord) -> Neighbors:
+
+def _in_bounds_neighbors(coord: Coord) -> Tuple[Coord, ...]:
     x, y = coord.x, coord.y
     neighbors = []
-    for dx, dy in itertools.product(range(-1, 2), range(-1, 2)):
-        if dx == 0 and dy == 0:
-            continue
-        neighbors.append(Coord(x+dx, y+dy))
-    return Neighbors(neighbors)
+    for dx, dy in NEIGHBOR_OFFSETS:
+        if 0 <= x+dx < SIZE_X and 0 <= y+dy < SIZE_Y:
+            # The shared instance, so lookups hit dict's identity check
+            neighbors.append(_SHARED_COORDS[x+dx, y+dy])
+    return tuple(neighbors)
+
+
+_NEIGHBORS: Dict[Coord, Tuple[Coord, ...]] = {c: _in_bounds_neighbors(c) for c in _GRID_COORDS}
+
+
+def get_neighbors(coord: Coord) -> Tuple[Coord, ...]:
+    return _NEIGHBORS[coord]
 
 
 class Minesweeper(object):
@@ -235,18 +251,31 @@ class Minesweeper(object):
         self.clicked_count = 0
         self.lost = False
         self.grid = {coord: Cell(coord=coord) for coord in grid_coords()}
-        self.probs = {coord: None for coord in grid_coords()}
+        # The same cells, flat and indexed by coord_index, for whole-board scans.
+        self.cells: List[Cell] = [None] * (SIZE_X * SIZE_Y)
+        for coord, cell in self.grid.items():
+            self.cells[coord_index(coord)] = cell
+        # Only coords that calc_prob has estimated have an entry
+        self.probs: Dict[Coord, int] = dict()
+        # Coords whose cell or prob changed since the display last drew them
+        self.dirty: Set[Coord] = set(grid_coords())
+        # Kept up to date by do(), so the solver tests membership rather than reading cell states
+        self.hidden: Set[Coord] = set(grid_coords())
+        self.clicked: Set[Coord] = set()
+        self.flagged: Set[Coord] = set()
         self.n_mines = N_MINES
         self.n_flags = 0
 
         # Assign mines
+        grid = self.grid
+        self.mine_coords: Tuple[Coord, ...] = tuple(mines)
         for coord in mines:
-            self.grid[coord].is_mine = True
+            grid[coord].is_mine = True
 
-        # Count adjacent mines
-        for coord in grid_coords():
-            self.grid[coord].n_adj_mines = len(
-                list(get_neighbors(coord).filter(lambda n: self.grid[n].is_mine)))
+        # Count adjacent mines, by crediting each mine's neighbors rather than scanning every cell
+        for coord in mines:
+            for n in _NEIGHBORS[coord]:
+                grid[n].n_adj_mines += 1
             
     def update_grid(self, clears: List[Coord], flags: List[Coord]) -> None:
         for c in clears: